@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+import threading
+import time
+from typing import List, Optional, Sequence
+
+class Endpoint:
+    """
+    A single Ollama server with its own concurrency limit.
+    """
+
+    def __init__(self, url: str, capacity: int):
+        self.url = url
+        self.capacity = capacity
+        self.in_flight = 0
+        self.unhealthy_until = 0.0
+
+class EndpointPool:
+    """
+    Dispatches requests to the least-loaded healthy endpoint.
+    Each endpoint admits at most `capacity` concurrent requests; callers wait
+    for a free slot. Endpoints that fail are skipped for `cooldown` seconds,
+    unless no healthy endpoint is left.
+    """
+
+    def __init__(self, urls: Sequence[str], capacity: int, cooldown: float = 30.0):
+        self.endpoints = [Endpoint(url, capacity) for url in urls]
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._acond = asyncio.Condition()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def _pick(self, exclude: Sequence[Endpoint]) -> Optional[Endpoint]:
+        # Caller must hold self._lock
+        available = [e for e in self.endpoints if e not in exclude]
+        now = time.monotonic()
+        # Endpoints in cooldown are only used when no other one is healthy;
+        # a healthy but busy endpoint is worth waiting for
+        healthy = [e for e in available if e.unhealthy_until <= now]
+        candidates = [e for e in healthy or available if e.in_flight < e.capacity]
+        if not candidates:
+            return None
+        endpoint = min(candidates, key=lambda e: e.in_flight / e.capacity)
+        endpoint.in_flight += 1
+        return endpoint
+
+    def _release(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.in_flight -= 1
+            # Waiters excluding this endpoint can't take the slot, so wake all
+            self._cond.notify_all()
+
+    def mark_failed(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.unhealthy_until = time.monotonic() + self.cooldown
+
+    @contextlib.contextmanager
+    def acquire(self, exclude: Sequence[Endpoint] = ()):
+        """
+        Reserves a slot on an endpoint for a blocking request.
+        """
+        with self._cond:
+            endpoint = self._pick(exclude)
+            while endpoint is None:
+                self._cond.wait()
+                endpoint = self._pick(exclude)
+        try:
+            yield endpoint
+        finally:
+            self._release(endpoint)
+
+    @contextlib.asynccontextmanager
+    async def aacquire(self, exclude: Sequence[Endpoint] = ()):
+        """
+        Reserves a slot on an endpoint for an async request.
+        """
+        async with self._acond:
+            while True:
+                with self._lock:
+                    endpoint = self._pick(exclude)
+                if endpoint is not None:
+                    break
+                await self._acond.wait()
+        try:
+            yield endpoint
+        finally:
+            self._release(endpoint)
+            async with self._acond:
+                self._acond.notify_all()
+
+def parse_hosts(value: Optional[str]) -> List[str]:
+    """
+    Splits a comma-separated list of Ollama base URLs.
+    """
+    if not value:
+        return []
+    return [host.strip().rstrip('/') for host in value.split(',') if host.strip()]
+
+class CircuitBreaker:
+    """
+    Trips after `threshold` consecutive failed calls and stays open for
+    `cooldown` seconds; a single success closes it again.
+    """
+
+    def __init__(self, threshold: int, cooldown: float = 60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._failures >= self.threshold and time.monotonic() - self._opened_at < self.cooldown
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self) -> bool:
+        """
+        Returns True if this failure tripped the breaker.
+        """
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+                return True
+            return False
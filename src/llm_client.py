@@ -1,13 +1,73 @@
 import os
-import json
-import urllib.request
-import urllib.error
-from schema import get_event_schema_description
+import logging
+import hashlib
+import functools
+import re
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import diskcache
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from typing import List, Optional
+from schema import get_event_schema_description, get_event_list_json_schema
+from endpoints import EndpointPool, CircuitBreaker, parse_hosts
 import time
 
+logger = logging.getLogger(__name__)
+
 # Configuration from environment variables
-OLLAMA_HOST = os.environ.get("OLLAMA_HOST")
+# OLLAMA_HOST may list several comma-separated servers to spread the load across
+OLLAMA_HOSTS = parse_hosts(os.environ.get("OLLAMA_HOST")) or ["http://localhost:11434"]
+OLLAMA_HOST = OLLAMA_HOSTS[0]
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL")
+# Concurrent requests admitted per server; match the server's own OLLAMA_NUM_PARALLEL
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "16"))
+# How long Ollama keeps the model loaded after a request ("30m", or -1 for indefinitely)
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+if OLLAMA_KEEP_ALIVE.lstrip('-').isdigit():
+    OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE)
+# Seconds to wait for a single LLM response before giving up
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "600"))
+
+_POOL = EndpointPool(OLLAMA_HOSTS, OLLAMA_NUM_PARALLEL)
+
+# Retries per LLM call for transient failures (connection errors, timeouts, 429/5xx)
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "5"))
+# Consecutive failed calls (after retries) before giving up on the run
+LLM_FAILURE_THRESHOLD = int(os.environ.get("LLM_FAILURE_THRESHOLD", "10"))
+_BREAKER = CircuitBreaker(LLM_FAILURE_THRESHOLD)
+
+# Request bodies are serialized with orjson and sent as raw bytes
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Shared session so consecutive calls reuse pooled keep-alive connections to Ollama
+_SESSION = requests.Session()
+for _host in OLLAMA_HOSTS:
+    _SESSION.mount(_host, HTTPAdapter(pool_connections=16, pool_maxsize=64))
+
+# Persistent cache of LLM responses, so re-runs and resumed runs skip pages already seen
+LLM_CACHE_DIR = os.environ.get(
+    "LLM_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.llm_cache"),
+)
+# diskcache evicts entries beyond its size limit (1 GB by default), which would
+# silently turn re-runs of a full dump back into LLM calls, so make it explicit
+LLM_CACHE_SIZE_GB = float(os.environ.get("LLM_CACHE_SIZE_GB", "64"))
+_cache = diskcache.Cache(
+    LLM_CACHE_DIR,
+    size_limit=int(LLM_CACHE_SIZE_GB * 1024 ** 3),
+)
+
+# Optional deterministic pre-cleaning: strip templates, links, refs and
+# comments with mwparserfromhell before the LLM sees the text, and skip the
+# LLM entirely when little text is left. Requires mwparserfromhell.
+WIKITEXT_PRESTRIP = os.environ.get("WIKITEXT_PRESTRIP", "").lower() in ("1", "true", "yes")
+PRESTRIP_MIN_LEN = int(os.environ.get("PRESTRIP_MIN_LEN", "200"))
+if WIKITEXT_PRESTRIP:
+    import mwparserfromhell
 
 PROMPT_CLEAN_TEXT = (
     "You are a helpful assistant that converts Wikipedia Wikitext to clean, human-readable plain text. "
@@ -25,7 +85,10 @@ PROMPT_CLEAN_TEXT_ALT = (
 )
 
 MODEL_TEMPERATURE_CLEAN_TEXT = 0.1  # Low temperature for fact-based extraction
-MODEL_NUM_PREDICT_CLEAN_TEXT = -1   # Allow sufficient output
+# Cleaned text is never longer than the input, so cap output at ~2x the input tokens
+# (estimated at ~4 chars per token) within these bounds to stop runaway generations
+MODEL_NUM_PREDICT_CLEAN_TEXT_MIN = 512
+MODEL_NUM_PREDICT_CLEAN_TEXT_MAX = 8192
 
 # Get the schema structure dynamically
 EVENT_SCHEMA_JSON = get_event_schema_description()
@@ -41,152 +104,536 @@ PROMPT_EVENT_EXTRACTION = (
     "Output ONLY the valid JSON list. If no events are found, return empty list []."
 )
 
+# The output structure is enforced by Ollama's structured outputs (see EVENT_LIST_SCHEMA),
+# so the prompt only carries the extraction rules.
 PROMPT_EVENT_EXTRACTION_ALT = (
-    "# Role: Expert Event Extraction & Structuring Assistant\n"
-    "## Objective\n"
-    "Your task is to analyze the provided text, identify all events (both explicitly stated and strongly implied), and extract them into a strict JSON list format.\n"
-    "## Input Source\n"
-    "You will strictly use **only the provided text** as your source of truth. Do not use external knowledge to fill in missing details (e.g., do not infer coordinates for a known city, do not guess the year based on historical context).\n"
-    "## JSON Output Schema\n"
-    "You must output a JSON list of objects `[]`. Each object must adhere to this structure:\n\n"
-    "```json\n"
-    "{\n"
-    "\"event_title\": \"Short title of the event (e.g., 'Birth of Roberto Gatti')\"\n",
-    "\"event_description\": \"Brief description based on text\"\n",
-    "\"start_time\": {\n"
-    "    \"time_str\": \"Raw string representation from text (e.g., '20 October 1964')\",\n"
-    "    \"precision\": \"One of: 'year', 'month', 'day', 'hour', 'minute', 'second', or null if unknown"",\n"
-    "    \"year\": \"int or null\",\n"
-    "    \"month\": \"int (1-12) or null\",\n"
-    "    \"day\": \"int (1-31) or null\",\n"
-    "    \"hour\": \"int (0-23) or null\",\n"
-    "    \"minute\": \"int (0-59) or null\",\n"
-    "    \"second\": \"int (0-59) or null\"\n"
-    "},\n"
-    "\"end_time\": \"null or same structure as start_time (use null if it is a specific time spot)\",\n"
-    "\"location\": {\n"
-        "\"location_name\": \"Name of location extracted from text\",\n"
-        "\"precision\": \"One of: 'city', 'country', 'coordinates', or null\",\n"
-        "\"latitude\": \"float or null (ONLY if present in text)\",\n"
-        "\"longitude\": \"float or null (ONLY if present in text)\"\n"
-    "}\n"
-    "}\n"
-    "Extraction Rules & Constraints\n"
-    "1. Event Identification\n"
-    "Explicit Events: Meetings, battles, ceremonies, movements.\n"
-    "Implied Events: Lifecycle states (Birth, Death, Retirement, Foundation of a company).\n"
-    "Example: \"Roberto Gatti (born 20 October 1964)\" -> Extract Event: \"Birth of Roberto Gatti\".\n"
-    "No Events Found: If the text contains no events, output [].\n"
-    "2. Time Handling (Strict)\n"
-    "Absolute Dates: Extract years, months, and days into their respective integer fields.\n"
-    "Relative Dates: If the text says \"two years later\" or \"the next day\", DO NOT calculate the date. Set the integer fields (year/month/day) to null. You may strictly keep the text phrase in time_str.\n"
-    "Precision: Set the precision field based on the most granular integer field filled.\n"
-    "3. Location Handling (Strict)\n"
-    "Names: Extract city/country names into location_name.\n"
-    "Coordinates: NEVER hallucinate or look up coordinates. If the text does not explicitly state \"lat 45.1, long 12.3\", then latitude and longitude must be null.\n"
-    "4. Missing Information\n"
-    "Do not guess. If a field (like location or end_time) is not mentioned or clearly implied, set it to null.\n"
-    "Output Format\n"
-    "Return ONLY the valid JSON list.\n"
-    "Do not include markdown formatting (like json ... ) unless necessary for the interface, but prefer raw text.\n"
-    "Do not add conversational text before or after the JSON.\n"
+    "Extract every event stated or clearly implied in the text (e.g. battles, ceremonies, births, deaths, foundations) "
+    "as a JSON list of events. Use only the text: set any field it does not state to null, "
+    "keep relative dates only in time_str, and never look up coordinates. Return [] if there are no events."
 )
 
+# JSON schema of the event list, used as the Ollama "format" for constrained decoding
+EVENT_LIST_SCHEMA = get_event_list_json_schema()
+
 MODEL_TEMPERATURE_EVENT_EXTRACTION = 0.8
-MODEL_NUM_PREDICT_EVENT_EXTRACTION = -1
+MODEL_NUM_PREDICT_EVENT_EXTRACTION = 2048  # Per document; plenty for a few dozen events
 
-def clean_with_llm(text: str) -> str:
+PROMPT_EVENT_EXTRACTION_BATCH = (
+    "The input holds several independent documents, each wrapped as <<<DOC n>>> ... <<<END>>>. "
+    "Extract every event stated or clearly implied in each document (e.g. battles, ceremonies, births, deaths, foundations) "
+    "and return one JSON object mapping each document number to its list of events. "
+    "Use only the text: set any field it does not state to null, "
+    "keep relative dates only in time_str, and never look up coordinates. Use [] for documents without events."
+)
+
+# Rough input budget per batched event-extraction call (estimated at ~4 chars per token)
+EVENT_BATCH_TOKENS = int(os.environ.get("EVENT_BATCH_TOKENS", "4096"))
+# Documents per batched call; bounds the output length and the format schema
+EVENT_BATCH_MAX_DOCS = int(os.environ.get("EVENT_BATCH_MAX_DOCS", "8"))
+
+# Static parts of the request payloads, built once at import and shared by every call
+_CLEAN_SYSTEM_MESSAGE = {"role": "system", "content": PROMPT_CLEAN_TEXT_ALT}
+_EVENTS_SYSTEM_MESSAGE = {"role": "system", "content": PROMPT_EVENT_EXTRACTION_ALT}
+_EVENTS_BATCH_SYSTEM_MESSAGE = {"role": "system", "content": PROMPT_EVENT_EXTRACTION_BATCH}
+
+# Redirect pages carry no content worth cleaning or mining for events
+_REDIRECT_RE = re.compile(r'^\s*#REDIRECT', re.I)
+# Texts shorter than this can't describe an event, so skip the LLM for them
+MIN_EVENT_TEXT_LEN = 64
+
+def _is_trivial(text: str) -> bool:
     """
-    Sends the raw Wikitext to the Ollama LLM for cleaning.
+    True for inputs that need no LLM call at all: empty text or redirects.
     """
-    if not text or not text.strip():
-        return ""
+    return not text or not text.strip() or bool(_REDIRECT_RE.match(text))
+
+def _is_trivial_for_events(text: str) -> bool:
+    """
+    True for inputs too small to hold an event.
+    """
+    return _is_trivial(text) or len(text.strip()) < MIN_EVENT_TEXT_LEN
+
+# Links to media, dropped whole rather than leaving their captions and options behind
+_FILE_LINK_PREFIXES = ("file:", "image:")
 
-    url = f"{OLLAMA_HOST}/api/generate"
-    
-    # Construct the prompt
-    full_prompt = f"{PROMPT_CLEAN_TEXT_ALT}\n\nInput Wikitext:\n{text}\n\nPlain Text Output:"
+def _strip_wikitext(text: str) -> str:
+    """
+    Removes the wiki markup that needs no judgement to remove, keeping link
+    labels and plain text. References and file links are dropped entirely,
+    while template parameters are kept, as templates such as
+    {{birth date|1964|10|20}} or {{convert}} carry dates and figures the
+    event extraction needs.
+    """
+    code = mwparserfromhell.parse(text)
+    for node in code.filter_tags(recursive=False, matches=lambda n: n.tag.strip().lower() == "ref"):
+        code.remove(node)
+    for node in code.filter_wikilinks(recursive=False, matches=lambda n: str(n.title).strip().lower().startswith(_FILE_LINK_PREFIXES)):
+        code.remove(node)
+    return code.strip_code(keep_template_params=True).strip()
 
-    payload = {
+def _clean_payload(text: str) -> dict:
+    """
+    Builds the Ollama chat payload for cleaning raw Wikitext.
+    The static instructions go in the system message so Ollama can reuse
+    the KV cache for that prefix; only the user message changes per page.
+    """
+    return {
         "model": OLLAMA_MODEL,
-        "prompt": full_prompt,
-        "stream": False,
+        "messages": [
+            _CLEAN_SYSTEM_MESSAGE,
+            {"role": "user", "content": text},
+        ],
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
         "options": {
             "temperature": MODEL_TEMPERATURE_CLEAN_TEXT,
-            "num_predict": MODEL_NUM_PREDICT_CLEAN_TEXT,
+            "num_predict": min(
+                MODEL_NUM_PREDICT_CLEAN_TEXT_MAX,
+                max(MODEL_NUM_PREDICT_CLEAN_TEXT_MIN, 2 * len(text) // 4),
+            ),
         }
     }
 
-    try:
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
-        with urllib.request.urlopen(req) as response:
-            if response.status == 200:
-                result = json.loads(response.read().decode('utf-8'))
-                return result.get('response', '').strip()
-            else:
-                print(f"Error calling LLM: HTTP {response.status}")
-                return text
-                
-    except Exception as e:
-        print(f"An error occurred during LLM processing: {e}")
-        return text
+def _events_payload(text: str) -> dict:
+    """
+    Builds the Ollama chat payload for event extraction.
+    """
+    logger.debug("Event extraction input: %s", text)
 
-def extract_events_with_llm(text: str) -> list:
+    return {
+        "model": OLLAMA_MODEL,
+        "messages": [
+            _EVENTS_SYSTEM_MESSAGE,
+            {"role": "user", "content": text},
+        ],
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "format": EVENT_LIST_SCHEMA,
+        "options": {
+            "temperature": MODEL_TEMPERATURE_EVENT_EXTRACTION,
+            "num_predict": MODEL_NUM_PREDICT_EVENT_EXTRACTION
+        }
+    }
+
+@functools.lru_cache(maxsize=None)
+def _batch_format(count: int) -> dict:
     """
-    Extracts historical events from the plain text using LLM.
-    Returns a list of event dictionaries.
+    Structured output format for a batch: an object with one event list per document.
     """
-    if not text or not text.strip():
-        return []
+    return {
+        "type": "object",
+        "properties": {str(i): EVENT_LIST_SCHEMA for i in range(1, count + 1)},
+        "required": [str(i) for i in range(1, count + 1)],
+    }
 
-    url = f"{OLLAMA_HOST}/api/generate"
-    
-    full_prompt = f"{PROMPT_EVENT_EXTRACTION_ALT}\n\nInput Text:\n{text}\n\nJSON Output:"
-    print(full_prompt)
+def _events_batch_payload(texts: List[str]) -> dict:
+    """
+    Builds the Ollama chat payload for extracting events from several texts in one call.
+    """
+    docs = "\n".join(
+        f"<<<DOC {i}>>>\n{text}\n<<<END>>>" for i, text in enumerate(texts, start=1)
+    )
 
-    payload = {
+    return {
         "model": OLLAMA_MODEL,
-        "prompt": full_prompt,
-        "stream": False,
-        "format": "json", # Force JSON mode if supported by Ollama/Model
+        "messages": [
+            _EVENTS_BATCH_SYSTEM_MESSAGE,
+            {"role": "user", "content": docs},
+        ],
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "format": _batch_format(len(texts)),
         "options": {
             "temperature": MODEL_TEMPERATURE_EVENT_EXTRACTION,
-            "num_predict": MODEL_NUM_PREDICT_EVENT_EXTRACTION
+            "num_predict": MODEL_NUM_PREDICT_EVENT_EXTRACTION * min(len(texts), EVENT_BATCH_MAX_DOCS)
         }
     }
 
+def _pack_batches(texts: List[str], max_tokens: int, max_docs: int) -> List[List[int]]:
+    """
+    Greedily groups text indices so each group stays within the token budget
+    and holds at most max_docs texts.
+    A text larger than the budget gets a group of its own.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = len(text) // 4
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_docs):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _parse_events_batch(response_text: str, count: int) -> Optional[List[list]]:
+    """
+    Parses the {"1": [...], "2": [...]} object returned for a batch.
+    Returns None if any document's events are missing or malformed.
+    """
     try:
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
-        with urllib.request.urlopen(req) as response:
-            if response.status == 200:
-                result = json.loads(response.read().decode('utf-8'))
-                response_text = result.get('response', '').strip()
-                
-                # Attempt to parse JSON
-                try:
-                    # Sometimes models wrap in ```json ... ```
-                    if "```json" in response_text:
-                        response_text = response_text.split("```json")[1].split("```")[0].strip()
-                    elif "```" in response_text:
-                        response_text = response_text.split("```")[1].strip()
-                        
-                    events = json.loads(response_text)
-                    if isinstance(events, list):
-                        return events
-                    return []
-                except json.JSONDecodeError:
-                    print(f"Failed to parse JSON from LLM event extraction: {response_text[:50]}...")
-                    return []
+        data = orjson.loads(response_text)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    results = []
+    for i in range(1, count + 1):
+        events = data.get(str(i))
+        if not isinstance(events, list):
+            return None
+        results.append(events)
+    return results
+
+def _parse_events(response_text: str) -> list:
+    """
+    Parses the event list out of the LLM response text.
+    """
+    try:
+        events = orjson.loads(response_text)
+        if isinstance(events, list):
+            return events
+        return []
+    except orjson.JSONDecodeError:
+        logger.warning("Failed to parse JSON from LLM event extraction: %s...", response_text[:50])
+        return []
+
+@functools.lru_cache(maxsize=None)
+def _digest(value: str) -> str:
+    """
+    sha256 of a static string, memoized so system prompts are hashed only once.
+    """
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+# Every structured output format is derived from EVENT_LIST_SCHEMA, so its digest stands in for it
+_EVENT_LIST_SCHEMA_DIGEST = _digest(orjson.dumps(EVENT_LIST_SCHEMA, option=orjson.OPT_SORT_KEYS).decode('utf-8'))
+
+def _cache_key(payload: dict) -> str:
+    """
+    Exact-match cache key: the payload carries the model, options and full prompt.
+    The static system prompt and format schema enter the key through precomputed
+    digests instead of being re-serialized on every call.
+    keep_alive only affects the server, not the response, so it is left out.
+    """
+    keyed = {k: v for k, v in payload.items() if k not in ("keep_alive", "messages", "format")}
+    keyed["messages"] = [
+        {"role": m["role"], "content": _digest(m["content"]) if m["role"] == "system" else m["content"]}
+        for m in payload["messages"]
+    ]
+    if "format" in payload:
+        keyed["format"] = _EVENT_LIST_SCHEMA_DIGEST
+    return hashlib.sha256(orjson.dumps(keyed, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+def _read_chunk(line: bytes, parts: List[str]) -> bool:
+    """
+    Appends the content of one streamed NDJSON chunk to parts.
+    Returns True once Ollama marks the response as done.
+    """
+    chunk = orjson.loads(line)
+    if "error" in chunk:
+        raise RuntimeError(chunk["error"])
+    parts.append(chunk.get('message', {}).get('content', ''))
+    return chunk.get('done', False)
+
+class LLMCallError(Exception):
+    """
+    Raised when an LLM call failed for good, after its retries. Callers skip
+    the page instead of recording it, so a re-run retries it.
+    """
+
+class LLMUnavailableError(Exception):
+    """
+    Raised once too many consecutive LLM calls have failed, so callers stop
+    instead of recording uncleaned text and empty event lists.
+    """
+
+class _HTTPStatusError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+# Overload and server-side errors are worth retrying; other HTTP errors (bad request, unknown model) are not
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+def _is_retryable(error: Exception) -> bool:
+    return not isinstance(error, _HTTPStatusError) or error.status in _RETRYABLE_STATUS
+
+def _backoff(attempt: int) -> float:
+    """
+    Exponential backoff with jitter, in seconds.
+    """
+    return min(30, 0.5 * 2 ** attempt) + random.random()
+
+def _chat(host: str, payload: dict) -> str:
+    """
+    Posts the payload to one Ollama server and collects the streamed response.
+    Raises on failure.
+    """
+    with _SESSION.post(
+        f"{host}/api/chat", data=orjson.dumps(payload), headers=_JSON_HEADERS,
+        timeout=LLM_TIMEOUT, stream=True,
+    ) as response:
+        if response.status_code != 200:
+            raise _HTTPStatusError(response.status_code)
+        parts = []
+        for line in response.iter_lines():
+            if line and _read_chunk(line, parts):
+                return "".join(parts)
+        raise RuntimeError("stream ended before completion")
+
+async def _achat(session: aiohttp.ClientSession, host: str, payload: dict) -> str:
+    """
+    Async variant of _chat.
+    """
+    async with session.post(f"{host}/api/chat", data=orjson.dumps(payload), headers=_JSON_HEADERS) as response:
+        if response.status != 200:
+            raise _HTTPStatusError(response.status)
+        parts = []
+        async for line in response.content:
+            if line.strip() and _read_chunk(line, parts):
+                return "".join(parts)
+        raise RuntimeError("stream ended before completion")
+
+def _record_failure(kind: str, error: Exception):
+    """
+    Logs a call that failed for good and raises: LLMUnavailableError if it
+    tripped the circuit breaker, LLMCallError otherwise.
+    """
+    logger.error("An error occurred during LLM call (%s): %s", kind, error)
+    if _BREAKER.record_failure():
+        raise LLMUnavailableError(f"{_BREAKER.threshold} consecutive LLM calls failed, last error: {error}") from error
+    raise LLMCallError(f"LLM call ({kind}) failed: {error}") from error
+
+def _cached(key: str) -> Optional[str]:
+    """
+    Returns the cached response for the key. On a miss, refuses to go on
+    while the circuit breaker is open.
+    """
+    cached = _cache.get(key)
+    if cached is None and _BREAKER.is_open():
+        raise LLMUnavailableError("LLM circuit breaker is open")
+    return cached
+
+def _store(key: str, output: str):
+    """
+    Records a successful call and caches its response.
+    """
+    _BREAKER.record_success()
+    _cache[key] = output
+
+class _Retry:
+    """
+    Attempt bookkeeping of one LLM call: transient failures are retried up
+    to LLM_MAX_RETRIES times, moving on to the other servers first and
+    backing off once all of them have failed.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.attempt = 0
+        self.rounds = 0
+        # Endpoints that failed in the current round
+        self.tried = []
+
+    def failed(self, endpoint, error: Exception) -> float:
+        """
+        Records a failed attempt and returns the seconds to wait before the
+        next one. Raises via _record_failure once the call has failed for good.
+        """
+        if not _is_retryable(error) or self.attempt == LLM_MAX_RETRIES:
+            _record_failure(self.kind, error)
+        self.attempt += 1
+        logger.warning("LLM call (%s) failed on %s, retrying: %s", self.kind, endpoint.url, error)
+        _POOL.mark_failed(endpoint)
+        self.tried.append(endpoint)
+        if len(self.tried) < len(_POOL):
+            return 0.0
+        # Every server failed this round; back off before trying them again
+        delay = _backoff(self.rounds)
+        self.rounds += 1
+        self.tried = []
+        return delay
+
+def _generate(payload: dict, kind: str) -> str:
+    """
+    Sends the payload to the least-loaded Ollama server and returns the raw
+    response text, consulting the response cache first.
+    Transient failures are retried (see _Retry); a call that failed for good
+    raises LLMCallError.
+    """
+    key = _cache_key(payload)
+    cached = _cached(key)
+    if cached is not None:
+        return cached
+
+    retry = _Retry(kind)
+    while True:
+        with _POOL.acquire(exclude=retry.tried) as endpoint:
+            try:
+                output = _chat(endpoint.url, payload)
+            except Exception as e:
+                error = e
             else:
-                print(f"Error calling LLM for events: HTTP {response.status}")
-                return []
-                
-    except Exception as e:
-        print(f"An error occurred during LLM event extraction: {e}")
+                _store(key, output)
+                return output
+        delay = retry.failed(endpoint, error)
+        if delay:
+            time.sleep(delay)
+
+async def _agenerate(session: aiohttp.ClientSession, payload: dict, kind: str) -> str:
+    """
+    Async variant of _generate.
+    """
+    key = _cache_key(payload)
+    cached = _cached(key)
+    if cached is not None:
+        return cached
+
+    retry = _Retry(kind)
+    while True:
+        async with _POOL.aacquire(exclude=retry.tried) as endpoint:
+            try:
+                output = await _achat(session, endpoint.url, payload)
+            except Exception as e:
+                error = e
+            else:
+                _store(key, output)
+                return output
+        delay = retry.failed(endpoint, error)
+        if delay:
+            await asyncio.sleep(delay)
+
+def warm_up():
+    """
+    Loads the model on every server ahead of the run, so the first pages
+    don't pay the cold-load cost. A generate request without a prompt only loads the model.
+    """
+    for host in OLLAMA_HOSTS:
+        try:
+            response = _SESSION.post(
+                f"{host}/api/generate",
+                json={"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=LLM_TIMEOUT,
+            )
+            if response.status_code != 200:
+                logger.warning("Failed to load model on %s: HTTP %s", host, response.status_code)
+        except Exception as e:
+            logger.warning("Failed to load model on %s: %s", host, e)
+
+def clean_with_llm(text: str) -> str:
+    """
+    Sends the raw Wikitext to the Ollama LLM for cleaning.
+    Raises LLMCallError if the call fails.
+    """
+    if _is_trivial(text):
+        return ""
+    if WIKITEXT_PRESTRIP:
+        text = _strip_wikitext(text)
+        if len(text) < PRESTRIP_MIN_LEN:
+            return text
+
+    output = _generate(_clean_payload(text), "clean")
+    return output.strip()
+
+def extract_events_with_llm(text: str) -> list:
+    """
+    Extracts historical events from the plain text using LLM.
+    Returns a list of event dictionaries; raises LLMCallError if the call fails.
+    """
+    if _is_trivial_for_events(text):
         return []
 
+    output = _generate(_events_payload(text), "events")
+    return _parse_events(output.strip())
+
+# Shared by all clean_with_llm_batch calls. Threads beyond the total server
+# capacity would only wait in _POOL.acquire.
+_BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=len(_POOL) * OLLAMA_NUM_PARALLEL, thread_name_prefix="llm-batch")
+
+def set_endpoint_capacity(capacity: int):
+    """
+    Limits this process to `capacity` concurrent requests per server, for
+    worker processes that share the servers with each other.
+    Must be called before any LLM call is made.
+    """
+    global _POOL, _BATCH_EXECUTOR
+    _POOL = EndpointPool(OLLAMA_HOSTS, capacity)
+    _BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=len(_POOL) * capacity, thread_name_prefix="llm-batch")
+
+def clean_with_llm_batch(texts: List[str]) -> List[str]:
+    """
+    Cleans several texts at once. Ollama has no multi-prompt endpoint, so the
+    calls are sent concurrently and batched server-side (OLLAMA_NUM_PARALLEL).
+    Returns the cleaned texts in input order.
+    """
+    if len(texts) <= 1:
+        return [clean_with_llm(text) for text in texts]
+    return list(_BATCH_EXECUTOR.map(clean_with_llm, texts))
+
+def extract_events_batch(texts: List[str]) -> List[list]:
+    """
+    Extracts events from several texts, packing small texts into shared
+    prompts to amortize the per-call overhead.
+    Returns one event list per input text, in input order.
+    Batches that fail or whose response can't be parsed fall back to one
+    call per text.
+    """
+    results = [[] for _ in texts]
+    pending = [i for i, text in enumerate(texts) if not _is_trivial_for_events(text)]
+
+    for batch in _pack_batches([texts[i] for i in pending], EVENT_BATCH_TOKENS, EVENT_BATCH_MAX_DOCS):
+        indices = [pending[j] for j in batch]
+        if len(indices) == 1:
+            results[indices[0]] = extract_events_with_llm(texts[indices[0]])
+            continue
+
+        batch_texts = [texts[i] for i in indices]
+        try:
+            output = _generate(_events_batch_payload(batch_texts), "events_batch")
+            parsed = _parse_events_batch(output.strip(), len(indices))
+        except LLMCallError:
+            parsed = None
+        if parsed is None:
+            logger.warning("Batched event extraction failed for %d texts, falling back to single calls", len(indices))
+            parsed = [extract_events_with_llm(text) for text in batch_texts]
+
+        for i, events in zip(indices, parsed):
+            results[i] = events
+
+    return results
+
+async def aclean_with_llm(session: aiohttp.ClientSession, text: str) -> str:
+    """
+    Async variant of clean_with_llm that reuses a shared aiohttp session,
+    so several pages can be in flight against the Ollama server at once.
+    """
+    if _is_trivial(text):
+        return ""
+    if WIKITEXT_PRESTRIP:
+        # Parsing a large page takes a while; keep it off the event loop
+        text = await asyncio.to_thread(_strip_wikitext, text)
+        if len(text) < PRESTRIP_MIN_LEN:
+            return text
+
+    output = await _agenerate(session, _clean_payload(text), "clean")
+    return output.strip()
+
+async def aextract_events_with_llm(session: aiohttp.ClientSession, text: str) -> list:
+    """
+    Async variant of extract_events_with_llm.
+    Returns a list of event dictionaries.
+    """
+    if _is_trivial_for_events(text):
+        return []
+
+    output = await _agenerate(session, _events_payload(text), "events")
+    return _parse_events(output.strip())
+
 if __name__ == "__main__":
     print(f"Clean text prompt:\n{PROMPT_CLEAN_TEXT}\n")
     print(f"Event extraction prompt:\n{PROMPT_EVENT_EXTRACTION}\n")
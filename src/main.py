@@ -1,8 +1,13 @@
 import argparse
+import asyncio
 import os
 import sys
 import json
+import orjson
+import logging
 import signal
+import threading
+import aiohttp
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -13,11 +18,13 @@ def sigterm_handler(signum, frame):
 
 signal.signal(signal.SIGTERM, sigterm_handler)
 
-from wiki_parser import process_xml
+from wiki_parser import iter_pages, aprocess_page, PAGE_FIELDS
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_FILE = os.path.join(CURRENT_DIR, "../data/raw/sample.xml")
-OUTPUT_FILE = os.path.join(CURRENT_DIR, "../data/processed/output.json")
+OUTPUT_FILE = os.path.join(CURRENT_DIR, "../data/processed/output.jsonl")
+# Number of pages processed concurrently. Should roughly match OLLAMA_NUM_PARALLEL on the server.
+DEFAULT_WORKERS = int(os.environ.get("LLM_WORKERS", "16"))
 
 from rich.console import Console, Group
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeElapsedColumn
@@ -26,17 +33,174 @@ from rich.syntax import Syntax
 from rich.panel import Panel
 from rich.live import Live
 from rich.layout import Layout
+from rich.logging import RichHandler
 from rich import print as rprint
 import llm_client
 
 console = Console()
 
+# Route log records through the shared console so they render above the Live display
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "WARNING").upper(),
+    format="%(message)s",
+    handlers=[RichHandler(console=console, show_path=False)],
+)
+
+class LiveView:
+    """
+    Renderable that rebuilds its contents on every refresh, so Live always
+    shows the current status without explicit update calls.
+    """
+    def __init__(self, build):
+        self.build = build
+
+    def __rich__(self):
+        return self.build()
+
+def load_processed_titles(output_file):
+    """
+    Reads an existing JSON Lines output and returns the titles already processed.
+    A trailing partial line left by an interrupted write is truncated away.
+    """
+    titles = set()
+    if not os.path.exists(output_file):
+        return titles
+
+    valid_end = 0
+    with open(output_file, 'rb+') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                titles.add(orjson.loads(line)["title"])
+            except (ValueError, KeyError, TypeError):
+                pass
+            valid_end += len(line)
+        f.truncate(valid_end)
+    return titles
+
+async def run_pipeline(input_file, workers, on_entry, status_callback=None, skip_titles=frozenset(), extract_events=True, articles_only=True, fields=PAGE_FIELDS):
+    """
+    Feeds pages from the XML dump through a queue to a pool of worker
+    coroutines, each awaiting the LLM calls on a shared aiohttp session.
+    The XML is parsed in a separate thread so it never blocks the event loop.
+    Pages whose title is in skip_titles are not processed, and pages whose
+    LLM calls failed are not passed to on_entry, so a re-run retries them.
+    """
+    queue = asyncio.Queue(maxsize=workers * 2)
+    connector = aiohttp.TCPConnector(limit=workers, keepalive_timeout=60)
+    # Same meaning as the requests timeout on the sync path: a limit on
+    # connecting and on each wait for the next streamed chunk, not on the
+    # whole generation, which can legitimately take longer on slow hardware
+    timeout = aiohttp.ClientTimeout(
+        total=None, sock_connect=llm_client.LLM_TIMEOUT, sock_read=llm_client.LLM_TIMEOUT,
+    )
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def worker():
+            while True:
+                title, raw_content = await queue.get()
+                try:
+                    entry = await aprocess_page(
+                        session, title, raw_content,
+                        status_callback=status_callback, extract_events=extract_events,
+                        fields=fields,
+                    )
+                    if entry is not None:
+                        on_entry(entry)
+                finally:
+                    queue.task_done()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+
+        loop = asyncio.get_running_loop()
+        produced = loop.create_future()
+
+        def settle(error):
+            # The future is already cancelled if a worker failed first
+            if produced.done():
+                return
+            if error is None:
+                produced.set_result(None)
+            else:
+                produced.set_exception(error)
+
+        # Set once the run is over, so the parser thread stops handing over pages
+        stopping = threading.Event()
+
+        def hand_over(page):
+            """
+            Puts a page on the queue from the parser thread, blocking while the
+            queue is full. Returns False if the run stopped in the meantime.
+            """
+            put = queue.put(page)
+            try:
+                future = asyncio.run_coroutine_threadsafe(put, loop)
+            except RuntimeError:
+                # The loop is already closed
+                put.close()
+                return False
+            while True:
+                try:
+                    future.result(timeout=0.1)
+                    return True
+                except TimeoutError:
+                    if stopping.is_set():
+                        future.cancel()
+                        return False
+
+        def produce():
+            error = None
+            try:
+                for page in iter_pages(input_file, status_callback=status_callback, articles_only=articles_only):
+                    if stopping.is_set():
+                        return
+                    if page[0] in skip_titles:
+                        continue
+                    if not hand_over(page):
+                        return
+            except BaseException as e:
+                error = e
+            if stopping.is_set():
+                return
+            try:
+                loop.call_soon_threadsafe(settle, error)
+            except RuntimeError:
+                # The loop closed after the check above; nobody waits for the result
+                pass
+
+        async def drained():
+            await produced
+            await queue.join()
+
+        # Daemon thread, so an interrupted run doesn't wait on a parser blocked on the queue
+        threading.Thread(target=produce, daemon=True).start()
+
+        try:
+            # Workers only finish by failing, so whichever completes first decides the outcome
+            finished = asyncio.create_task(drained())
+            done, _ = await asyncio.wait([finished, *tasks], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopping.set()
+        for task in [finished, *tasks]:
+            task.cancel()
+        await asyncio.gather(finished, *tasks, return_exceptions=True)
+        for task in done:
+            task.result()
+
 def main():
     parser = argparse.ArgumentParser(description="Extract Wikipedia data from XML dump.")
     parser.add_argument("input_file", nargs='?', default=INPUT_FILE, help="Path to input XML file")
-    parser.add_argument("output_file", nargs='?', default=OUTPUT_FILE, help="Path to output JSON file")
+    parser.add_argument("output_file", nargs='?', default=OUTPUT_FILE, help="Path to output JSON Lines file")
+    parser.add_argument("--no-resume", action="store_true", help="Overwrite the output file instead of skipping pages already in it")
+    parser.add_argument("--no-events", action="store_true", help="Only clean the text, skip event extraction")
+    parser.add_argument("--all-pages", action="store_true", help="Also process non-article namespaces and redirects")
+    parser.add_argument("--no-raw", action="store_true", help="Leave the raw wikitext out of the output")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of pages processed concurrently")
     
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
     
     # Configuration Panel contents
     config_table = Table.grid(padding=1)
@@ -44,8 +208,9 @@ def main():
     config_table.add_column(style="magenta")
     config_table.add_row("Input File:", args.input_file)
     config_table.add_row("Output File:", args.output_file)
-    config_table.add_row("LLM Host:", llm_client.OLLAMA_HOST)
+    config_table.add_row("LLM Host:", ", ".join(llm_client.OLLAMA_HOSTS))
     config_table.add_row("LLM Model:", llm_client.OLLAMA_MODEL)
+    config_table.add_row("Workers:", str(args.workers))
     
     config_panel = Panel(
         config_table,
@@ -59,9 +224,14 @@ def main():
         console.print(config_panel)
         console.print(f"[bold red]Error:[/bold red] Input file '{args.input_file}' not found.")
         sys.exit(1)
+
+    # The JSON Lines output doubles as a checkpoint: pages already in it are skipped
+    processed_titles = set() if args.no_resume else load_processed_titles(args.output_file)
+    config_table.add_row("Resuming:", f"{len(processed_titles)} pages already processed")
         
-    data = []
+    last_entry = None
     count = 0
+    failed = 0
     
     # Status Panel state
     current_status = {
@@ -100,7 +270,7 @@ def main():
     task_id = progress.add_task("[cyan]Overall Progress[/cyan]", total=None)
 
     def update_status(info):
-        nonlocal current_status
+        nonlocal current_status, failed
         # Sync title if present
         if "title" in info:
             current_status["title"] = info["title"]
@@ -122,26 +292,44 @@ def main():
             current_status["stage"] = "[bold cyan]Extracting Events...[/bold cyan]"
             progress.update(task_id, description=f"Extracting Events: [bold]{info['title']}[/bold]")
 
+        elif info["stage"] == "failed":
+            failed += 1
+            current_status["stage"] = "[bold red]LLM call failed, skipped[/bold red]"
+
         elif info["stage"] == "events_done":
             current_status["stage"] = "Events Extracted"
             current_status["event_count"] = info.get('count', 0)
             progress.update(task_id, description="Overall Progress")
 
+    with console.status("Loading model..."):
+        llm_client.warm_up()
+
     import time
     start_time = time.time()
     
     try:
+        console.print(f"Writing to '[cyan]{args.output_file}[/cyan]'...")
         # Use Live display to render the group of widgets
         # Reordered: Config -> Status -> Progress
-        with Live(Group(config_panel, get_status_panel(), progress), refresh_per_second=10, console=console) as live:
+        view = LiveView(lambda: Group(config_panel, get_status_panel(), progress))
+        with open(args.output_file, 'wb' if args.no_resume else 'ab') as f, \
+                Live(view, refresh_per_second=4, console=console):
             
-            for entry in process_xml(args.input_file, status_callback=update_status):
-                data.append(entry)
+            def on_entry(entry):
+                nonlocal count, last_entry
+                # One JSON object per line, flushed as soon as the page is done
+                f.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
+                f.flush()
+                last_entry = entry
                 count += 1
                 progress.update(task_id, advance=1)
-                
-                # Update panel with the live context (Reordered)
-                live.update(Group(config_panel, get_status_panel(), progress))
+            
+            asyncio.run(run_pipeline(
+                args.input_file, args.workers, on_entry,
+                status_callback=update_status, skip_titles=processed_titles,
+                extract_events=not args.no_events, articles_only=not args.all_pages,
+                fields=PAGE_FIELDS - {'raw_content'} if args.no_raw else PAGE_FIELDS,
+            ))
                 
         end_time = time.time()
         total_time = end_time - start_time
@@ -154,6 +342,8 @@ def main():
         summary_table.add_row("Total Pages:", str(count))
         summary_table.add_row("Total Time:", f"{total_time:.2f}s")
         summary_table.add_row("Avg Time/Page:", f"{avg_time:.2f}s")
+        if failed:
+            summary_table.add_row("Failed Pages:", f"{failed} (re-run to retry them)")
         
         summary_panel = Panel(
             summary_table,
@@ -163,9 +353,9 @@ def main():
         )
         console.print(summary_panel)
 
-        if data:
+        if last_entry:
             console.print("\n[bold]Last processed item sample:[/bold]")
-            sample_item = data[-1].copy()
+            sample_item = last_entry.copy()
             if len(sample_item.get('raw_content', '')) > 200:
                 sample_item['raw_content'] = sample_item['raw_content'][:200] + "..."
             if len(sample_item.get('plain_text_content', '')) > 200:
@@ -174,16 +364,16 @@ def main():
             json_str = json.dumps(sample_item, indent=2, ensure_ascii=False)
             syntax = Syntax(json_str, "json", theme="monokai", line_numbers=False)
             console.print(syntax)
-        
-        console.print(f"\nWriting to '[cyan]{args.output_file}[/cyan]'...")
-        with open(args.output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
             
         console.print("[bold green]Done.[/bold green]")
         
     except KeyboardInterrupt:
         console.print("\n[bold yellow]Processing interrupted by user.[/bold yellow]")
         sys.exit(0)
+    except llm_client.LLMUnavailableError as e:
+        console.print(f"\n[bold red]LLM unavailable:[/bold red] {e}")
+        console.print(f"Processed pages are saved in '[cyan]{args.output_file}[/cyan]'; re-run to resume.")
+        sys.exit(1)
     except Exception as e:
         console.print(f"\n[bold red]Error during processing:[/bold red] {e}")
         sys.exit(1)
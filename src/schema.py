@@ -1,9 +1,10 @@
-from typing import TypedDict, Optional, List, get_type_hints, Annotated
+from typing import TypedDict, Optional, List, Union, get_origin, get_args, is_typeddict, Annotated
+import functools
 import json
 
 class EventTime(TypedDict):
-    time_str: Annotated[str, "String representation of time"]
-    precision: Annotated[str, "year or month or day or hour or minute or second"]
+    time_str: Annotated[Optional[str], "String representation of time, or null"]
+    precision: Annotated[Optional[str], "year or month or day or hour or minute or second, or null if unknown"]
     year: Annotated[Optional[int], "int or null"]
     month: Annotated[Optional[int], "int or null"]
     day: Annotated[Optional[int], "int or null"]
@@ -12,42 +13,52 @@ class EventTime(TypedDict):
     second: Annotated[Optional[int], "int or null"]
 
 class EventLocation(TypedDict):
-    location_name: Annotated[str, "Name of location"]
-    precision: Annotated[str, "spot or city or country or continent"]
+    location_name: Annotated[Optional[str], "Name of location, or null"]
+    precision: Annotated[Optional[str], "spot or city or country or continent, or null if unknown"]
     latitude: Annotated[Optional[float], "float or null"]
     longitude: Annotated[Optional[float], "float or null"]
 
 class HistoricalEvent(TypedDict):
     event_title: Annotated[str, "Short title of the event"]
     event_description: Annotated[str, "Brief description"]
-    start_time: EventTime  # No annotation = recurse
+    # Only the title and description are always known; anything the text
+    # doesn't state is null, which the structured output must allow
+    start_time: Optional[EventTime]  # No annotation = recurse
     end_time: Annotated[Optional[EventTime], "null or same structure as start_time (null if time spot)"]
-    location: EventLocation  # No annotation = recurse
+    location: Optional[EventLocation]  # No annotation = recurse
 
-class WikiPage(TypedDict):
+# Not total: records only hold the keys selected with process_xml's fields
+# (raw_content is left out by default when events are extracted, events
+# when they aren't)
+class WikiPage(TypedDict, total=False):
     title: str
     raw_content: str
     plain_text_content: str
     events: List[HistoricalEvent]
     link: str
 
+@functools.lru_cache(maxsize=None)
 def generate_schema(cls) -> dict:
     """
     Recursively generates a schema dictionary from a TypedDict class
     using Annotated metadata.
+    The result is cached per class and shared, so callers must not modify it.
     """
     schema = {}
-    type_hints = get_type_hints(cls, include_extras=True)
+    # The TypedDicts here have no string annotations or inheritance, so the
+    # raw __annotations__ are enough and get_type_hints isn't needed
+    type_hints = cls.__annotations__
     
     for key, value in type_hints.items():
         # Check if it's annotated
-        if hasattr(value, '__metadata__') and value.__metadata__:
+        if get_origin(value) is Annotated:
             # Use the description string
-            schema[key] = value.__metadata__[0]
+            schema[key] = get_args(value)[1]
         else:
-            # If not annotated, check if it's a TypedDict and recurse
-            # Unpack Optional/List types if necessary to find the underlying TypedDict
-            # For this simple use case, we assume direct TypedDict or simple type
+            # If not annotated, check if it's a TypedDict and recurse,
+            # unpacking Optional to find the underlying TypedDict
+            if get_origin(value) is Union:
+                value = next(arg for arg in get_args(value) if arg is not type(None))
             if isinstance(value, type) and issubclass(value, dict):
                 schema[key] = generate_schema(value)
             else:
@@ -55,6 +66,7 @@ def generate_schema(cls) -> dict:
                 
     return schema
 
+@functools.lru_cache(maxsize=1)
 def get_event_schema_description() -> str:
     """
     Generates a JSON schema string derived from the TypedDict definitions
@@ -62,3 +74,43 @@ def get_event_schema_description() -> str:
     """
     event_structure = generate_schema(HistoricalEvent)
     return json.dumps([event_structure], indent=2)
+
+# Python types of the schema fields and their JSON schema counterparts
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+def generate_json_schema(tp) -> dict:
+    """
+    Recursively converts a type (TypedDicts included) into a JSON schema dict,
+    carrying Annotated metadata over as field descriptions.
+    """
+    description = None
+    if get_origin(tp) is Annotated:
+        description = tp.__metadata__[0]
+        tp = get_args(tp)[0]
+
+    origin = get_origin(tp)
+    if origin is Union:
+        # Optional[X]
+        args = [arg for arg in get_args(tp) if arg is not type(None)]
+        schema = {"anyOf": [generate_json_schema(args[0]), {"type": "null"}]}
+    elif origin is list:
+        schema = {"type": "array", "items": generate_json_schema(get_args(tp)[0])}
+    elif is_typeddict(tp):
+        properties = {
+            key: generate_json_schema(value)
+            for key, value in tp.__annotations__.items()
+        }
+        schema = {"type": "object", "properties": properties, "required": list(properties)}
+    else:
+        schema = {"type": _JSON_TYPES[tp]}
+
+    if description:
+        schema["description"] = description
+    return schema
+
+def get_event_list_json_schema() -> dict:
+    """
+    JSON schema of the event list returned by the LLM,
+    passed to Ollama as the structured output format.
+    """
+    return generate_json_schema(List[HistoricalEvent])
@@ -1,94 +1,377 @@
-import xml.etree.ElementTree as ET
-import urllib.parse
-from typing import TypedDict, Generator, Optional, Callable, List
-from llm_client import clean_with_llm, extract_events_with_llm
+import logging
+import mmap
+import multiprocessing
+import os
+from lxml import etree as LET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AbstractSet, Generator, Optional, Callable, List, Tuple, Union
+import aiohttp
+import orjson
+from llm_client import (
+    clean_with_llm, extract_events_with_llm, aclean_with_llm, aextract_events_with_llm,
+    clean_with_llm_batch, extract_events_batch, LLMCallError,
+    OLLAMA_NUM_PARALLEL, set_endpoint_capacity,
+)
 from schema import WikiPage, HistoricalEvent
 
-# EventTime, EventLocation, HistoricalEvent moved to schema.py
+logger = logging.getLogger(__name__)
 
-def get_tag_name(element):
-    """
-    Extracts the tag name without having to hardcode the namespace.
-    E.g. {http://www.mediawiki.org/xml/export-0.11/}page -> page
-    """
-    if '}' in element.tag:
-        return element.tag.split('}', 1)[1]
-    return element.tag
+_WIKI_PREFIX = "https://en.wikipedia.org/wiki/"
+_SPACE_TO_UNDERSCORE = str.maketrans({' ': '_'})
 
 def construct_wiki_url(title):
     """
     Constructs a Wikipedia URL from the page title.
     Replaces spaces with underscores.
     """
-    safe_title = title.replace(' ', '_')
-    return f"https://en.wikipedia.org/wiki/{safe_title}"
+    return _WIKI_PREFIX + title.translate(_SPACE_TO_UNDERSCORE)
+
+# Target size of the byte ranges process_xml_sharded hands to each process
+SHARD_BYTES = 64 * 1024 * 1024
+# Read size when feeding a byte range to the pull parser
+READ_CHUNK_BYTES = 1024 * 1024
+# Read-ahead buffer of the dump file handle; lxml reads in small chunks,
+# which with the default 8 KB buffer means a syscall every few reads
+READ_BUFFER_BYTES = 4 * 1024 * 1024
+
+# Keys of a full output record
+PAGE_FIELDS = frozenset(WikiPage.__annotations__)
+
+# MediaWiki namespace id of regular articles
+ARTICLE_NAMESPACE = '0'
 
-def process_xml(file_path: str, status_callback: Optional[Callable[[dict], None]] = None) -> Generator[WikiPage, None, None]:
+def export_namespace(file_path: str) -> str:
     """
-    Iteratively parses the XML file yielding dictionaries of extracted data.
+    Returns the '{namespace}' prefix declared on the dump's root element,
+    or an empty string if the export is not namespaced.
     """
-    # Namespaces can be tricky, so we'll strip them or handle them generically.
-    # We are looking for 'page' elements.
-    
-    context = ET.iterparse(file_path, events=('end',))
-    
+    with open(file_path, 'rb') as f:
+        for event, root in LET.iterparse(f, events=('start',), huge_tree=True, recover=True):
+            tag = root.tag
+            return tag[:tag.index('}') + 1] if tag.startswith('{') else ''
+    return ''
+
+def is_article(ns_id: Optional[str], raw_content: str) -> bool:
+    """
+    True for pages in the main namespace that are not redirects.
+    Dumps without an <ns> element are treated as all articles.
+    """
+    if ns_id is not None and ns_id.strip() != ARTICLE_NAMESPACE:
+        return False
+    return not raw_content.lstrip()[:9].upper().startswith('#REDIRECT')
+
+def _read_pages(context, ns: str, status_callback: Optional[Callable[[dict], None]], articles_only: bool) -> Generator[Tuple[str, str], None, None]:
+    """
+    Turns the <page> end events of an lxml parser into (title, raw_content) tuples.
+    """
+    tag_title = ns + 'title'
+    tag_ns = ns + 'ns'
+    path_text = f"{ns}revision/{ns}text"
+
     for event, elem in context:
-        tag = get_tag_name(elem)
+        title = elem.findtext(tag_title)
+        text_content = elem.findtext(path_text) or ""
+
+        if title and (not articles_only or is_article(elem.findtext(tag_ns), text_content)):
+            if status_callback:
+                status_callback({"stage": "start", "title": title})
+                if text_content:
+                    status_callback({"stage": "content", "title": title, "len": len(text_content)})
+            yield title, text_content
         
-        if tag == 'page':
-            # Initialize data placeholders
-            title = None
-            text_content = None
-            
-            # Since we are at the 'end' of the page element, 
-            # we can traverse its children locally or look at what we've built.
-            # However, simpler to look at children directly if file isn't massive within a single page node.
-            # Standard wikipedia pages aren't RAM-breakingly huge usually.
-            
-            # We need to find the title first for the callback if we want to be precise,
-            # but element children order might vary. Usually title is first.
-            # Let's iterate and extract.
-            
-            for child in elem:
-                child_tag = get_tag_name(child)
-                if child_tag == 'title':
-                    title = child.text
-                    if status_callback and title:
-                        status_callback({"stage": "start", "title": title})
-                elif child_tag == 'revision':
-                    for rev_child in child:
-                        if get_tag_name(rev_child) == 'text':
-                            text_content = rev_child.text
-                            if status_callback and text_content and title:
-                                status_callback({"stage": "content", "title": title, "len": len(text_content)})
-                            break
-            
-            if title:
-                raw_content = text_content or ""
-                if status_callback:
-                    status_callback({"stage": "llm", "title": title})
-                
-                plain_text = clean_with_llm(raw_content)
-                
-                # Extract events
-                if status_callback:
-                    status_callback({"stage": "events", "title": title})
-                    
-                events = extract_events_with_llm(plain_text)
-                # DEBUG PRINT
-                import sys
-                print(f"Extracting events for {title}, count: {len(events)}", file=sys.stderr)
-                
-                if status_callback:
-                    status_callback({"stage": "events_done", "title": title, "count": len(events)})
+        # Clear the element to save memory, and drop the already processed
+        # siblings so the root doesn't keep a growing list of empty <page>s
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+def iter_pages(file_path: str, status_callback: Optional[Callable[[dict], None]] = None, articles_only: bool = True) -> Generator[Tuple[str, str], None, None]:
+    """
+    Iteratively parses the XML file yielding (title, raw_content) tuples.
+    No LLM work is done here, so callers are free to schedule it however they like.
+    With articles_only, talk/user/template/category/... pages and redirects
+    are skipped, as they never contain historical events.
+    """
+    # The export namespace varies between dump versions but is fixed within
+    # a file, so the fully-qualified tags are built once from the root and
+    # compared directly instead of going through {*} wildcards per page.
+    ns = export_namespace(file_path)
+
+    # lxml filters on the tag in C, so only <page> elements reach Python.
+    with open(file_path, 'rb', buffering=READ_BUFFER_BYTES) as f:
+        context = LET.iterparse(f, events=('end',), tag=ns + 'page', huge_tree=True, recover=True)
+        yield from _read_pages(context, ns, status_callback, articles_only)
+
+def split_dump(file_path: str, chunk_bytes: int = SHARD_BYTES) -> List[Tuple[int, int]]:
+    """
+    Splits the dump into byte ranges of roughly chunk_bytes that each hold
+    whole <page> elements: a range starts at a <page> tag and ends right
+    after a </page> tag. The siteinfo header is not part of any range.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = mm.find(b'<page>')
+            last = mm.rfind(b'</page>')
+            if start < 0 or last < start:
+                return []
+            last += len(b'</page>')
+
+            ranges = []
+            while start < last:
+                end = mm.find(b'</page>', start + chunk_bytes, last)
+                end = last if end < 0 else end + len(b'</page>')
+                ranges.append((start, end))
+                start = end
+            return ranges
+
+def iter_pages_range(file_path: str, start: int, end: int, ns: str, status_callback: Optional[Callable[[dict], None]] = None, articles_only: bool = True) -> Generator[Tuple[str, str], None, None]:
+    """
+    Like iter_pages, but only parses the pages in one byte range from split_dump.
+    The range is wrapped in a root element carrying the export namespace ns
+    (see export_namespace), as the real root tag lies outside of it.
+    """
+    parser = LET.XMLPullParser(events=('end',), tag=ns + 'page', huge_tree=True, recover=True)
+    xmlns = f' xmlns="{ns[1:-1]}"' if ns else ''
+    parser.feed(f"<mediawiki{xmlns}>".encode())
+
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(READ_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            parser.feed(chunk)
+            yield from _read_pages(parser.read_events(), ns, status_callback, articles_only)
+
+    parser.feed(b"</mediawiki>")
+    yield from _read_pages(parser.read_events(), ns, status_callback, articles_only)
+    parser.close()
+
+def make_page(title: str, raw_content: str, plain_text: str, events: Optional[List[HistoricalEvent]], fields: AbstractSet[str] = PAGE_FIELDS) -> WikiPage:
+    """
+    Assembles the output record for a page, keeping only the keys in fields.
+    events is None when event extraction was skipped, and the key is left out.
+    Leaving out raw_content means only the much smaller plain text is kept
+    once the page has been cleaned.
+    """
+    page = {
+        'title': title,
+        'raw_content': raw_content,
+        'plain_text_content': plain_text,
+        'events': events,
+        'link': construct_wiki_url(title)
+    }
+    if events is None:
+        del page['events']
+    for key in page.keys() - fields:
+        del page[key]
+    return page
+
+def _page_failed(title: str, error: Exception, status_callback: Optional[Callable[[dict], None]]):
+    """
+    Reports a page that is skipped because one of its LLM calls failed.
+    """
+    logger.warning("Skipping %s: %s", title, error)
+    if status_callback:
+        status_callback({"stage": "failed", "title": title})
+
+def process_page(title: str, raw_content: str, status_callback: Optional[Callable[[dict], None]] = None, extract_events: bool = True, fields: AbstractSet[str] = PAGE_FIELDS) -> Optional[WikiPage]:
+    """
+    Runs the LLM cleaning and, unless disabled, event extraction for a single page.
+    Returns None if an LLM call failed, so the page isn't recorded half done.
+    """
+    if status_callback:
+        status_callback({"stage": "llm", "title": title})
+    
+    try:
+        plain_text = clean_with_llm(raw_content)
+        events = None
+        
+        # Extract events
+        if extract_events:
+            if status_callback:
+                status_callback({"stage": "events", "title": title})
                 
-                yield {
-                    'title': title,
-                    'raw_content': raw_content,
-                    'plain_text_content': plain_text,
-                    'events': events,
-                    'link': construct_wiki_url(title)
-                }
-            
-            # Clear the element to save memory
-            elem.clear()
+            events = extract_events_with_llm(plain_text)
+            logger.debug("Extracted %d events for %s", len(events), title)
+    except LLMCallError as e:
+        _page_failed(title, e, status_callback)
+        return None
+    
+    if status_callback:
+        status_callback({"stage": "events_done", "title": title, "count": len(events or [])})
+    
+    return make_page(title, raw_content, plain_text, events, fields)
+
+async def aprocess_page(session: aiohttp.ClientSession, title: str, raw_content: str, status_callback: Optional[Callable[[dict], None]] = None, extract_events: bool = True, fields: AbstractSet[str] = PAGE_FIELDS) -> Optional[WikiPage]:
+    """
+    Async variant of process_page, sharing one aiohttp session across pages.
+    """
+    if status_callback:
+        status_callback({"stage": "llm", "title": title})
+
+    try:
+        plain_text = await aclean_with_llm(session, raw_content)
+        events = None
+
+        if extract_events:
+            if status_callback:
+                status_callback({"stage": "events", "title": title})
+
+            events = await aextract_events_with_llm(session, plain_text)
+            logger.debug("Extracted %d events for %s", len(events), title)
+    except LLMCallError as e:
+        _page_failed(title, e, status_callback)
+        return None
+
+    if status_callback:
+        status_callback({"stage": "events_done", "title": title, "count": len(events or [])})
+
+    return make_page(title, raw_content, plain_text, events, fields)
+
+def process_batch(pages: List[Tuple[str, str]], status_callback: Optional[Callable[[dict], None]] = None, extract_events: bool = True, fields: AbstractSet[str] = PAGE_FIELDS) -> List[WikiPage]:
+    """
+    Runs the LLM cleaning and event extraction for several pages together:
+    the cleaning calls go out concurrently and event extraction packs the
+    cleaned texts into shared prompts. Returns the pages in input order.
+    If an LLM call fails, the pages are redone one by one (see process_page)
+    and those that fail again are left out.
+    """
+    if len(pages) > 1:
+        try:
+            return _process_batch(pages, status_callback, extract_events, fields)
+        except LLMCallError as e:
+            logger.warning("Batch of %d pages failed, processing them one by one: %s", len(pages), e)
+
+    # Responses of the calls that succeeded are cached, so redoing them is cheap
+    results = [
+        process_page(title, raw_content, status_callback=status_callback, extract_events=extract_events, fields=fields)
+        for title, raw_content in pages
+    ]
+    return [page for page in results if page is not None]
+
+def _process_batch(pages: List[Tuple[str, str]], status_callback: Optional[Callable[[dict], None]], extract_events: bool, fields: AbstractSet[str]) -> List[WikiPage]:
+    if status_callback:
+        for title, _ in pages:
+            status_callback({"stage": "llm", "title": title})
+
+    plain_texts = clean_with_llm_batch([raw_content for _, raw_content in pages])
+
+    events_per_page = [None] * len(pages)
+    if extract_events:
+        if status_callback:
+            for title, _ in pages:
+                status_callback({"stage": "events", "title": title})
+
+        events_per_page = extract_events_batch(plain_texts)
+
+    results = []
+    for (title, raw_content), plain_text, events in zip(pages, plain_texts, events_per_page):
+        if status_callback:
+            status_callback({"stage": "events_done", "title": title, "count": len(events or [])})
+        results.append(make_page(title, raw_content, plain_text, events, fields))
+    return results
+
+def _process_pages(pages, status_callback: Optional[Callable[[dict], None]], max_workers: int, batch_size: int, extract_events: bool, fields: AbstractSet[str]) -> Generator[WikiPage, None, None]:
+    """
+    Runs process_batch over the (title, raw_content) tuples with a bounded
+    window of in-flight batches, yielding the pages in input order.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    # Bounded window of in-flight batches, so parsing can't race ahead of the LLM
+    pending = deque()
+    batch = []
+    try:
+        for page in pages:
+            batch.append(page)
+            if len(batch) < batch_size:
+                continue
+            pending.append(executor.submit(process_batch, batch, status_callback, extract_events, fields))
+            batch = []
+            if len(pending) >= 2 * max_workers:
+                yield from pending.popleft().result()
+        if batch:
+            pending.append(executor.submit(process_batch, batch, status_callback, extract_events, fields))
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+def _select_fields(extract_events: bool, fields: Optional[AbstractSet[str]]) -> Tuple[bool, frozenset]:
+    """
+    Resolves the record keys for process_xml: by default every field but
+    raw_content when events are extracted, and every field otherwise.
+    Event extraction is skipped when the events aren't asked for.
+    """
+    if fields is None:
+        fields = PAGE_FIELDS - {'raw_content'} if extract_events else PAGE_FIELDS
+    fields = frozenset(fields)
+    return extract_events and 'events' in fields, fields
+
+def _dump_pages(pages) -> Generator[bytes, None, None]:
+    """
+    Serializes records to JSON Lines, one newline-terminated line each.
+    """
+    for page in pages:
+        yield orjson.dumps(page, option=orjson.OPT_APPEND_NEWLINE)
+
+def process_xml(file_path: str, status_callback: Optional[Callable[[dict], None]] = None, max_workers: int = 16, batch_size: int = 1, extract_events: bool = True, articles_only: bool = True, fields: Optional[AbstractSet[str]] = None, as_bytes: bool = False) -> Generator[Union[WikiPage, bytes], None, None]:
+    """
+    Iteratively parses the XML file yielding dictionaries of extracted data.
+    With extract_events=False only the plain text is produced; articles_only
+    is passed on to iter_pages. fields selects the keys of the yielded
+    records (see _select_fields). With as_bytes the records are yielded as
+    JSON Lines, ready to be written to a file opened in binary mode.
+    Pages are grouped into batches of batch_size (see process_batch); up to
+    max_workers batches have their LLM calls in flight at once, while parsing
+    continues on the calling thread. Pages are yielded in input order.
+    """
+    extract_events, fields = _select_fields(extract_events, fields)
+    pages = iter_pages(file_path, status_callback=status_callback, articles_only=articles_only)
+    records = _process_pages(pages, status_callback, max_workers, batch_size, extract_events, fields)
+    yield from _dump_pages(records) if as_bytes else records
+
+def _init_shard_worker(capacity: int):
+    # Runs once in each worker process of process_xml_sharded
+    set_endpoint_capacity(capacity)
+
+def _process_range(task: tuple) -> Union[List[WikiPage], List[bytes]]:
+    # Runs in a worker process of process_xml_sharded
+    file_path, start, end, ns, max_workers, batch_size, extract_events, articles_only, fields, as_bytes = task
+    pages = iter_pages_range(file_path, start, end, ns, articles_only=articles_only)
+    records = _process_pages(pages, None, max_workers, batch_size, extract_events, fields)
+    return list(_dump_pages(records) if as_bytes else records)
+
+def process_xml_sharded(file_path: str, processes: Optional[int] = None, max_workers: int = 16, batch_size: int = 1, extract_events: bool = True, articles_only: bool = True, fields: Optional[AbstractSet[str]] = None, as_bytes: bool = False, shard_bytes: int = SHARD_BYTES) -> Generator[Union[WikiPage, bytes], None, None]:
+    """
+    Multi-process variant of process_xml for large dumps.
+    The file is cut into byte ranges at </page> boundaries (see split_dump)
+    which a pool of processes parse and process independently, each with up
+    to max_workers batches in flight. Pages are yielded one range at a time
+    in completion order, not in input order, and there are no status callbacks.
+    With as_bytes the workers serialize the records (see process_xml), so
+    only bytes are sent back instead of pickled dicts.
+    Workers are spawned rather than forked, so they don't share the parent's
+    HTTP connections, and OLLAMA_NUM_PARALLEL is divided between them (at
+    least one request per server each). As with any spawned pool, the
+    calling script needs an `if __name__ == "__main__":` guard.
+    """
+    extract_events, fields = _select_fields(extract_events, fields)
+    ns = export_namespace(file_path)
+    tasks = [
+        (file_path, start, end, ns, max_workers, batch_size, extract_events, articles_only, fields, as_bytes)
+        for start, end in split_dump(file_path, shard_bytes)
+    ]
+    if not tasks:
+        return
+    processes = min(processes or os.cpu_count(), len(tasks))
+    capacity = max(1, OLLAMA_NUM_PARALLEL // processes)
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes, initializer=_init_shard_worker, initargs=(capacity,)) as pool:
+        for pages in pool.imap_unordered(_process_range, tasks):
+            yield from pages